@@ -1,11 +1,17 @@
 import argparse
+import datetime
 import itertools
+import json
 import os
+import re
 import shlex
+import shutil
 import signal
+import stat
 import subprocess
 import sys
 import tempfile
+import time
 import typing
 import unicodedata
 from contextlib import contextmanager
@@ -18,39 +24,175 @@ class Mode(Enum):
     XCOPY = 2
 
 
+class Anchor(Enum):
+    WORD_START = 1
+    LINE_START = 2
+
+
+class Scope(Enum):
+    PANE = 1
+    SESSION = 2
+
+
+class LabelScheme(Enum):
+    FIXED = 1
+    WEIGHTED = 2
+
+
+class _Recorder:
+    _file_name: str
+    _argv: typing.List[str]
+    _events: typing.List[typing.Dict[str, typing.Any]]
+    _stage_times: typing.Dict[str, float]
+
+    def __init__(self, file_name: str, argv: typing.List[str]) -> None:
+        self._file_name = file_name
+        self._argv = argv
+        self._events = []
+        self._stage_times = {}
+
+    def add_event(self, event_type: str, **fields: typing.Any) -> None:
+        self._events.append({"type": event_type, **fields})
+
+    def add_stage_time(self, stage: str, stage_time: float) -> None:
+        self._stage_times[stage] = stage_time
+
+    def save(self) -> None:
+        recording = {
+            "argv": self._argv,
+            "events": self._events,
+            "stage_times": self._stage_times,
+        }
+        os.makedirs(os.path.dirname(self._file_name), exist_ok=True)
+        with open(self._file_name, "w", encoding="utf-8") as f:
+            json.dump(recording, f, ensure_ascii=False, indent=1)
+
+
+class _Replayer:
+    _events: typing.List[typing.Dict[str, typing.Any]]
+    _event_index: int
+    _recorded_stage_times: typing.Dict[str, float]
+    _stage_times: typing.Dict[str, float]
+
+    def __init__(self, recording: typing.Dict[str, typing.Any]) -> None:
+        self._events = recording["events"]
+        self._event_index = 0
+        self._recorded_stage_times = recording["stage_times"]
+        self._stage_times = {}
+
+    def next_event(
+        self, event_type: str, **fields: typing.Any
+    ) -> typing.Dict[str, typing.Any]:
+        actual_event = {"type": event_type, **fields}
+        if self._event_index == len(self._events):
+            raise Exception(
+                "replay: unexpected event #{}: {}".format(
+                    self._event_index, json.dumps(actual_event, ensure_ascii=False)
+                )
+            )
+        event = self._events[self._event_index]
+        if event["type"] != event_type or any(
+            event[k] != v for k, v in fields.items()
+        ):
+            raise Exception(
+                "replay: mismatched event #{}: expected {}, got {}".format(
+                    self._event_index,
+                    json.dumps(event, ensure_ascii=False),
+                    json.dumps(actual_event, ensure_ascii=False),
+                )
+            )
+        self._event_index += 1
+        return event
+
+    def add_stage_time(self, stage: str, stage_time: float) -> None:
+        self._stage_times[stage] = stage_time
+
+    def finish(self) -> None:
+        if self._event_index < len(self._events):
+            raise Exception(
+                "replay: missing event #{}: {}".format(
+                    self._event_index,
+                    json.dumps(self._events[self._event_index], ensure_ascii=False),
+                )
+            )
+        sys.stderr.write("{:<24}{:>12}{:>12}\n".format("stage", "recorded", "replayed"))
+        for stage, recorded_stage_time in self._recorded_stage_times.items():
+            stage_time = self._stage_times.get(stage)
+            sys.stderr.write(
+                "{:<24}{:>10.3f}ms{:>12}\n".format(
+                    stage,
+                    recorded_stage_time * 1000,
+                    "-" if stage_time is None else "{:.3f}ms".format(stage_time * 1000),
+                )
+            )
+        sys.stderr.write("replay: {} events matched\n".format(self._event_index))
+
+
 def parse_args() -> None:
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument("--mode")
     arg_parser.add_argument("--smart-case")
     arg_parser.add_argument("--label-chars")
+    arg_parser.add_argument("--label-scheme")
     arg_parser.add_argument("--label-attrs")
     arg_parser.add_argument("--text-attrs")
     arg_parser.add_argument("--print-command-only")
     arg_parser.add_argument("--cursor-pos")
     arg_parser.add_argument("--regions")
     arg_parser.add_argument("--auto-begin-selection")
+    arg_parser.add_argument("--anchor")
+    arg_parser.add_argument("--scope")
+    arg_parser.add_argument("--update-index")
+    arg_parser.add_argument("--remove-index")
+    arg_parser.add_argument("--record-dir")
+    arg_parser.add_argument("--replay")
 
     class Args(argparse.Namespace):
         def __init__(self) -> None:
             self.mode = ""
             self.smart_case = ""
             self.label_chars = ""
+            self.label_scheme = ""
             self.label_attrs = ""
             self.text_attrs = ""
             self.print_command_only = ""
             self.cursor_pos = ""
             self.regions = ""
             self.auto_begin_selection = ""
+            self.anchor = ""
+            self.scope = ""
+            self.update_index: typing.Optional[str] = None
+            self.remove_index: typing.Optional[str] = None
+            self.record_dir = ""
+            self.replay = ""
 
     args = arg_parser.parse_args(sys.argv[1:], namespace=Args())
+    global RECORDER, REPLAYER
+    RECORDER = None
+    REPLAYER = None
+    if args.replay != "":
+        with open(args.replay, "r", encoding="utf-8") as f:
+            recording = json.load(f)
+        args = arg_parser.parse_args(recording["argv"], namespace=Args())
+        REPLAYER = _Replayer(recording)
+    elif args.record_dir != "":
+        time_str = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S-%f")
+        record_file_name = os.path.join(
+            args.record_dir, "easyjump_{}.json".format(time_str)
+        )
+        RECORDER = _Recorder(record_file_name, sys.argv[1:])
 
-    global MODE, SMART_CASE, LABEL_CHARS, LABEL_ATTRS, TEXT_ATTRS, PRINT_COMMAND_ONLY, CURSOR_POS, REGIONS, AUTO_BEGIN_SELECTION
+    global MODE, SMART_CASE, LABEL_CHARS, LABEL_SCHEME, LABEL_ATTRS, TEXT_ATTRS, PRINT_COMMAND_ONLY, CURSOR_POS, REGIONS, AUTO_BEGIN_SELECTION, ANCHOR, SCOPE, UPDATE_INDEX, REMOVE_INDEX
     MODE = {
         "mouse": Mode.MOUSE,
         "xcopy": Mode.XCOPY,
     }[args.mode.lower() or "mouse"]
     SMART_CASE = (args.smart_case.lower() or "on") == "on"
     LABEL_CHARS = args.label_chars or "fjdkslaghrueiwoqptyvncmxzb1234567890"
+    LABEL_SCHEME = {
+        "fixed": LabelScheme.FIXED,
+        "weighted": LabelScheme.WEIGHTED,
+    }[args.label_scheme.lower() or "fixed"]
     LABEL_ATTRS = args.label_attrs or "\033[1m\033[38;5;245m"
     TEXT_ATTRS = args.text_attrs or "\033[0m\033[31m"
     PRINT_COMMAND_ONLY = (
@@ -66,6 +208,17 @@ def parse_args() -> None:
         map(lambda x: int(x), [] if args.regions == "" else args.regions.split(","))
     )
     AUTO_BEGIN_SELECTION = (args.auto_begin_selection.lower() or "on") == "on"
+    ANCHOR = {
+        "": None,
+        "word": Anchor.WORD_START,
+        "line": Anchor.LINE_START,
+    }[args.anchor.lower()]
+    SCOPE = {
+        "pane": Scope.PANE,
+        "session": Scope.SESSION,
+    }[args.scope.lower() or "pane"]
+    UPDATE_INDEX = args.update_index
+    REMOVE_INDEX = args.remove_index
 
 
 parse_args()
@@ -127,16 +280,17 @@ class Screen:
     _snapshot: str
     last_key: str
 
-    def __init__(self) -> None:
-        self._fill_info()
+    def __init__(self, pane_id: typing.Optional[str] = None) -> None:
+        self._fill_info(pane_id)
         if MODE == Mode.MOUSE:
             self._exit_copy_mode()
         self._lines = self._get_lines()
         if not self._alternate_allowed:
             self._snapshot = self._get_snapshot()
 
-    def _fill_info(self) -> None:
+    def _fill_info(self, pane_id: typing.Optional[str]) -> None:
         tmux_vars = _get_tmux_vars(
+            pane_id,
             "pane_id",
             "pane_tty",
             "pane_width",
@@ -217,16 +371,7 @@ class Screen:
             args += ["-S", str(start_line_number), "-E", str(end_line_number)]
         args += ["-p"]
         chars_list = _run_tmux_command(*args).split("\n")
-        lines: typing.List[Line] = []
-        for i, chars in enumerate(chars_list):
-            display_width = _calculate_display_width(chars)
-            if i == len(chars_list) - 1:
-                trailing_whitespaces = " " * (self._width - display_width)
-            else:
-                trailing_whitespaces = " " * (self._width - display_width) + "\r\n"
-            line = Line(chars, trailing_whitespaces)
-            lines.append(line)
-        return lines
+        return _make_lines(chars_list, self._width)
 
     def _get_snapshot(self) -> str:
         snapshot = _run_tmux_command(
@@ -236,9 +381,14 @@ class Screen:
 
     @contextmanager
     def label_positions(
-        self, positions: typing.List["Position"], labels: typing.List[str]
+        self,
+        positions: typing.List["Position"],
+        labels: typing.List[str],
+        lines: typing.Optional[typing.List["Line"]] = None,
     ) -> typing.Generator[None, None, None]:
-        raw_with_labels = self._do_label_positions(positions, labels)
+        raw_with_labels = self._do_label_positions(
+            positions, labels, self._lines if lines is None else lines
+        )
         if MODE == Mode.XCOPY:
             self._exit_copy_mode()
         if self._alternate_allowed:
@@ -255,10 +405,13 @@ class Screen:
                 self._enter_copy_mode(True)
 
     def _do_label_positions(
-        self, positions: typing.List["Position"], labels: typing.List[str]
+        self,
+        positions: typing.List["Position"],
+        labels: typing.List[str],
+        lines: typing.List["Line"],
     ) -> str:
         temp: typing.List[str] = []
-        for line in self._lines:
+        for line in lines:
             temp.append(line.chars)
             temp.append(line.trailing_whitespaces)
         raw = "".join(temp)
@@ -272,6 +425,10 @@ class Screen:
                 segment = TEXT_ATTRS + raw[offset : position.offset]
                 segments.append(segment)
             segment = LABEL_ATTRS + label
+            covered_chars = raw[position.offset : position.offset + len(label)]
+            padding_width = _calculate_display_width(covered_chars) - len(label)
+            if padding_width > 0:  # keep wide chars' columns
+                segment += " " * padding_width
             segments.append(segment)
             offset = position.offset + len(label)
         if offset < len(raw):
@@ -281,22 +438,22 @@ class Screen:
         return raw_with_labels
 
     def _enter_alternate(self) -> None:
-        with open(self._tty, "w") as f:
-            f.write("\033[?1049h")
+        _write_tty(self._tty, "\033[?1049h")
         self._alternate_on = True
 
     def _update(self, raw: str) -> None:
-        with open(self._tty, "w") as f:
-            f.write("\033[2J\033[H\033[0m")
-            f.write(raw)
-            cursor_x, cursor_y = self._cursor_pos[-1]
-            f.write("\033[{};{}H".format(cursor_y + 1, cursor_x + 1))
+        cursor_x, cursor_y = self._cursor_pos[-1]
+        _write_tty(
+            self._tty,
+            "\033[2J\033[H\033[0m"
+            + raw
+            + "\033[{};{}H".format(cursor_y + 1, cursor_x + 1),
+        )
         if self._copy_mode is not None and not self._alternate_on:
             self._copy_mode.scroll_position += self._height  # raw.count("\n") + 1
 
     def _leave_alternate(self) -> None:
-        with open(self._tty, "w") as f:
-            f.write("\033[?1049l")
+        _write_tty(self._tty, "\033[?1049l")
         self._alternate_on = False
 
     def jump_to_pos(self, x: int, y: int) -> None:
@@ -349,15 +506,17 @@ class Screen:
                 ";",
             )
         tmux_command += ("send-keys", "-t", self._id, "-X", "start-of-line", ";")
-        char_index = _calculate_char_index(self._lines[y].chars, x)
-        if char_index >= 1:
+        chars = self._lines[y].chars
+        char_index = _calculate_char_index(chars, x)
+        number_of_chars = _count_non_zero_width_chars(chars[:char_index])
+        if number_of_chars >= 1:
             tmux_command += (
                 "send-keys",
                 "-t",
                 self._id,
                 "-X",
                 "-N",
-                str(char_index),
+                str(number_of_chars),
                 "cursor-right",
                 ";",
             )
@@ -374,10 +533,22 @@ class Screen:
         ]
         args.extend(keys_in_hex[i : i + 2] for i in range(0, len(keys_in_hex), 2))
         if PRINT_COMMAND_ONLY:
-            sys.stdout.write(shlex.join(("tmux", *args)))
+            _write_stdout(shlex.join(("tmux", *args)))
         else:
             _run_tmux_command(*args)
 
+    @property
+    def id(self) -> str:
+        return self._id
+
+    @property
+    def width(self) -> int:
+        return self._width
+
+    @property
+    def height(self) -> int:
+        return self._height
+
     @property
     def cursor_pos(self) -> typing.Tuple[int, int]:
         return self._cursor_pos[-1]
@@ -474,6 +645,36 @@ class Position:
     offset: int
 
 
+@dataclass
+class _Pane:
+    id: str
+    window_index: int
+    pane_index: int
+    width: int
+    window_active: bool
+    fingerprint: str
+
+
+@dataclass
+class _Hit:
+    pane: _Pane
+    line: Line
+    position: Position
+
+
+def _make_lines(chars_list: typing.List[str], width: int) -> typing.List[Line]:
+    lines: typing.List[Line] = []
+    for i, chars in enumerate(chars_list):
+        display_width = _calculate_display_width(chars)
+        if i == len(chars_list) - 1:
+            trailing_whitespaces = " " * (width - display_width)
+        else:
+            trailing_whitespaces = " " * (width - display_width) + "\r\n"
+        line = Line(chars, trailing_whitespaces)
+        lines.append(line)
+    return lines
+
+
 def get_key(last_key: str) -> str:
     key_length = 2
     message_template = (
@@ -539,11 +740,17 @@ def select_label(labels: typing.List[str]) -> int:
 
 @contextmanager
 def _get_char() -> typing.Generator[typing.Callable[[str], str], None, None]:
+    if REPLAYER is not None:
+        temp_file_name = REPLAYER.next_event("fifo")["path"]
+        yield lambda message: _do_get_char(message, temp_file_name)
+        return
     temp_dir_name = tempfile.mkdtemp()
     try:
         temp_file_name = os.path.join(temp_dir_name, "fifo")
         try:
             os.mkfifo(temp_file_name)
+            if RECORDER is not None:
+                RECORDER.add_event("fifo", path=temp_file_name)
             yield lambda message: _do_get_char(message, temp_file_name)
         finally:
             os.unlink(temp_file_name)
@@ -561,7 +768,26 @@ def _do_get_char(message: str, temp_file_name: str) -> str:
             shlex.quote(temp_file_name)
         ),
     )
+    if REPLAYER is not None:
+        event = REPLAYER.next_event("char")
+        if event.get("timeout", False):
+            raise TimeoutError()
+        char = event["char"]
+    else:
+        try:
+            char = _read_char(temp_file_name)
+        except TimeoutError:
+            if RECORDER is not None:
+                RECORDER.add_event("char", timeout=True)
+            raise
+        if RECORDER is not None:
+            RECORDER.add_event("char", char=char)
+    if char in ("\x1b", "\x03", "\x04"):  # Esc / CTRL-C / CTRL-D
+        raise SystemExit()
+    return char
+
 
+def _read_char(temp_file_name: str) -> str:
     def handler(signum, frame) -> None:
         raise TimeoutError()
 
@@ -573,8 +799,6 @@ def _do_get_char(message: str, temp_file_name: str) -> str:
     finally:
         signal.alarm(0)
         signal.signal(signal.SIGALRM, signal.SIG_DFL)
-    if char in ("\x1b", "\x03", "\x04"):  # Esc / CTRL-C / CTRL-D
-        raise SystemExit()
     return char
 
 
@@ -602,26 +826,198 @@ def search_for_key(lines: typing.List[Line], key: str) -> typing.List[Position]:
     return positions
 
 
+def find_anchors(
+    lines: typing.List[Line],
+    anchor: Anchor,
+    label_length: int,
+    max_number_of_positions: int,
+    cursor_pos: typing.Tuple[int, int],
+) -> typing.List[Position]:
+    pattern = {
+        Anchor.WORD_START: re.compile(r"\w+"),
+        Anchor.LINE_START: re.compile(r"^\s*(\S)"),
+    }[anchor]
+    candidates = _find_anchor_candidates(lines, pattern, label_length)
+    min_column_distance = label_length
+    while True:
+        positions: typing.List[Position] = []
+        one_anchor_per_line = True
+        for position in candidates:
+            if len(positions) >= 1:
+                last_position = positions[-1]
+                if position.line_number == last_position.line_number:
+                    if (
+                        position.offset < last_position.offset + label_length
+                        or position.column_number
+                        < last_position.column_number + min_column_distance
+                    ):
+                        continue
+                    one_anchor_per_line = False
+            positions.append(position)
+        if len(positions) <= max_number_of_positions:
+            return positions
+        if one_anchor_per_line:
+            break
+        min_column_distance += label_length
+    # even one anchor per line is too many, keep the ones closest to the cursor
+    rank_2_position_idx = _rank_positions(positions, cursor_pos)
+    return [positions[i] for i in sorted(rank_2_position_idx[:max_number_of_positions])]
+
+
+def _find_anchor_candidates(
+    lines: typing.List[Line], pattern: typing.Pattern[str], label_length: int
+) -> typing.List[Position]:
+    line_offset = 0
+    positions: typing.List[Position] = []
+    for line_index, line in enumerate(lines):
+        room = len(line.chars) + len(line.trailing_whitespaces.rstrip("\r\n"))
+        last_char_index = 0
+        column_index = 0
+        for match in pattern.finditer(line.chars):
+            char_index = match.start(match.lastindex or 0)
+            if char_index + label_length > room:
+                break
+            column_index += _calculate_display_width(
+                line.chars[last_char_index:char_index]
+            )
+            last_char_index = char_index
+            covered_chars = line.chars[char_index : char_index + label_length]
+            covered_width = _calculate_display_width(covered_chars)
+            covered_width += label_length - len(covered_chars)  # trailing whitespaces
+            if covered_width < label_length:
+                continue  # label would be wider than the text it replaces
+            if not _point_is_in_region(column_index + 1, line_index + 1):
+                continue
+            offset = line_offset + char_index
+            position = Position(line_index + 1, column_index + 1, offset)
+            positions.append(position)
+        line_offset += len(line.chars) + len(line.trailing_whitespaces)
+    return positions
+
+
 def _calculate_char_index(line: str, x: int) -> int:
+    if line.isascii():
+        return min(x, len(line))
+    char_widths = _get_char_widths()
+    # a cell per column, so without zero-width chars column x is in the first x + 2
+    cells = char_widths(line[: x + 2]).replace("\x02", "\x02\x03")
+    if "\x00" not in cells:
+        i = x + (cells[x : x + 1] == "\x03")
+        if i >= len(cells):
+            return len(line)
+        return i - cells.count("\x03", 0, i)
     display_width = 0
-    for i, c in enumerate(line):
-        if display_width >= x:
+    for i, w in enumerate(char_widths(line).encode("latin-1")):
+        if display_width >= x and w != 0:
             return i
-        if unicodedata.east_asian_width(c) == "W":
-            display_width += 2
-        else:
-            display_width += 1
+        display_width += w
     return len(line)
 
 
 def _calculate_display_width(s: str) -> int:
-    display_width = 0
-    for c in s:
-        if unicodedata.east_asian_width(c) in ("W", "F"):
-            display_width += 2
+    if s.isascii():
+        return len(s)
+    char_widths = _get_char_widths()(s)
+    return len(s) + char_widths.count("\x02") - char_widths.count("\x00")
+
+
+def _count_non_zero_width_chars(s: str) -> int:
+    if s.isascii():
+        return len(s)
+    char_widths = _get_char_widths()(s)
+    return len(s) - char_widths.count("\x00")
+
+
+# bump whenever _calculate_char_width changes, so that cached width tables are rebuilt
+_WIDTH_RULE_VERSION = 2
+
+# maps each char of a string to the char whose code point is its width
+_char_widths: typing.Optional[typing.Callable[[str], str]] = None
+
+
+def _get_char_widths() -> typing.Callable[[str], str]:
+    global _char_widths
+    if _char_widths is None:
+        width_table = _load_width_table()
+        if width_table is None:
+            _char_widths = lambda s: "".join(map(chr, map(_calculate_char_width, s)))
         else:
-            display_width += 1
-    return display_width
+            _char_widths = lambda s: s.translate(width_table)
+    return _char_widths
+
+
+def _calculate_char_width(c: str) -> int:
+    if unicodedata.east_asian_width(c) in ("W", "F"):
+        return 2
+    if unicodedata.category(c) in ("Mn", "Me", "Cf"):
+        return 1 if c == "\u00ad" else 0  # soft hyphen is visible
+    if "\u1160" <= c <= "\u11ff":  # Hangul Jamo vowels and final consonants
+        return 0
+    return 1
+
+
+def _load_width_table() -> typing.Optional[str]:
+    dir_name = _get_cache_dir_name()
+    if not _make_private_dir(dir_name):
+        return None
+    file_name = os.path.join(
+        dir_name,
+        "width_table_v{}_{}.bin".format(
+            _WIDTH_RULE_VERSION, unicodedata.unidata_version
+        ),
+    )
+    try:
+        with open(file_name, "rb") as f:
+            if os.fstat(f.fileno()).st_uid == os.getuid():
+                width_table = f.read()
+                if len(width_table) == sys.maxunicode + 1:
+                    return width_table.decode("latin-1")
+    except OSError:
+        pass
+    if not os.access(dir_name, os.W_OK):
+        return None  # calculating widths char by char is cheaper than regenerating
+    width_table = _generate_width_table()
+    temp_file_name = None
+    try:
+        fd, temp_file_name = tempfile.mkstemp(dir=dir_name)
+        with os.fdopen(fd, "wb") as f:
+            f.write(width_table)
+        os.replace(temp_file_name, file_name)
+    except OSError:
+        if temp_file_name is not None:
+            _remove_file(temp_file_name)
+    return width_table.decode("latin-1")
+
+
+def _generate_width_table() -> bytes:
+    return bytes(map(_calculate_char_width, map(chr, range(sys.maxunicode + 1))))
+
+
+def _get_cache_dir_name() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "easyjump")
+
+
+def _make_private_dir(dir_name: str) -> bool:
+    try:
+        os.makedirs(dir_name, mode=0o700, exist_ok=True)
+        dir_stat = os.lstat(dir_name)
+        if not stat.S_ISDIR(dir_stat.st_mode) or dir_stat.st_uid != os.getuid():
+            return False
+        if dir_stat.st_mode & 0o077 != 0:
+            os.chmod(dir_name, 0o700)
+    except OSError:
+        return False
+    return True
+
+
+def _remove_file(file_name: str) -> None:
+    try:
+        os.unlink(file_name)
+    except OSError:
+        pass
 
 
 def _test_potential_key(potential_key: str, key: str) -> bool:
@@ -674,11 +1070,67 @@ def generate_labels(key_length: int, number_of_positions: int) -> typing.List[st
     return labels
 
 
+def generate_weighted_labels(
+    key_length: int, number_of_positions: int
+) -> typing.List[str]:
+    # same split between short and long labels as generate_labels, which already
+    # needs the fewest keystrokes when labels can't be longer than the key, but
+    # chars early in LABEL_CHARS (home row) are kept for the nearest positions and
+    # repeated chars are allowed, so up to n**key_length labels are available.
+    n = len(LABEL_CHARS)
+    x = 1
+    y = 0
+    while x < key_length:
+        m = n**x
+        if m >= number_of_positions:
+            break
+        for i in range(m + 1):
+            if m - i + i * n >= number_of_positions:
+                y = i
+                break
+        else:
+            x += 1
+            continue
+        break
+    char_costs = {c: i for i, c in enumerate(LABEL_CHARS)}
+
+    def label_cost(label: str) -> typing.Tuple[int, int]:
+        return len(label), sum(char_costs[c] for c in label)
+
+    base_labels = ["".join(p) for p in itertools.product(tuple(LABEL_CHARS), repeat=x)]
+    base_labels.sort(key=label_cost)
+    labels = base_labels[: len(base_labels) - y]
+    for label_prefix in base_labels[len(base_labels) - y :]:
+        for c in LABEL_CHARS:
+            labels.append(label_prefix + c)
+    labels.sort(key=label_cost)
+    return labels[:number_of_positions]
+
+
+def _generate_labels(key_length: int, number_of_positions: int) -> typing.List[str]:
+    if LABEL_SCHEME == LabelScheme.WEIGHTED:
+        return generate_weighted_labels(key_length, number_of_positions)
+    return generate_labels(key_length, number_of_positions)
+
+
 def assign_labels(
     labels: typing.List[str],
     positions: typing.List[Position],
     cursor_pos: typing.Tuple[int, int],
 ) -> typing.List[str]:
+    rank_2_position_idx = _rank_positions(positions, cursor_pos)
+    assigned_labels = [""] * len(positions)
+    for rank, position_idx in enumerate(rank_2_position_idx):
+        if rank < len(labels):
+            assigned_labels[position_idx] = labels[rank]
+        else:
+            assigned_labels[position_idx] = ""
+    return assigned_labels
+
+
+def _rank_positions(
+    positions: typing.List[Position], cursor_pos: typing.Tuple[int, int]
+) -> typing.List[int]:
     if len(CURSOR_POS) == 2:
         cursor_pos = (CURSOR_POS[0] - 1, CURSOR_POS[1] - 1)
 
@@ -690,13 +1142,7 @@ def assign_labels(
 
     rank_2_position_idx = list(range(len(positions)))
     rank_2_position_idx.sort(key=lambda i: distance_to_cursor(positions[i]))
-    assigned_labels = [""] * len(positions)
-    for rank, position_idx in enumerate(rank_2_position_idx):
-        if rank < len(labels):
-            assigned_labels[position_idx] = labels[rank]
-        else:
-            assigned_labels[position_idx] = ""
-    return assigned_labels
+    return rank_2_position_idx
 
 
 def find_label(
@@ -709,43 +1155,438 @@ def find_label(
     return None
 
 
+def search_session_for_key(screen: Screen, key: str) -> typing.List[_Hit]:
+    panes = _list_panes("-s")
+    panes.sort(
+        key=lambda p: (
+            p.id != screen.id,
+            not p.window_active,
+            p.window_index,
+            p.pane_index,
+        )
+    )
+    index_dir_name = _get_index_dir_name()
+    hits: typing.List[_Hit] = []
+    for pane in panes:
+        if pane.id == screen.id:
+            lines = screen.lines
+            positions = search_for_key(lines, key)
+            rank_2_position_idx = _rank_positions(positions, screen.cursor_pos)
+            positions = [positions[i] for i in rank_2_position_idx]
+        else:
+            if pane.window_active:
+                # visible and cheap to capture, always use the current contents
+                chars_list = None
+            else:
+                chars_list = _load_pane_index(index_dir_name, pane)
+            if chars_list is None:
+                chars_list = _capture_pane(pane.id)
+                _save_pane_index(index_dir_name, pane, chars_list)
+            lines = _make_lines(chars_list, pane.width)
+            positions = search_for_key(lines, key)
+        for position in positions:
+            hit = _Hit(pane, lines[position.line_number - 1], position)
+            hits.append(hit)
+    return hits
+
+
+def list_hits(
+    hits: typing.List[_Hit],
+    width: int,
+    label_length: int,
+    key_length: int,
+    number_of_hidden_hits: int,
+) -> typing.Tuple[typing.List[Line], typing.List[Position]]:
+    rows: typing.List[str] = []
+    for hit in hits:
+        tag = "{}{}.{} {}:{} ".format(
+            " " * (label_length + 1),
+            hit.pane.window_index,
+            hit.pane.pane_index,
+            hit.position.line_number,
+            hit.position.column_number,
+        )
+        text = _clip_around(
+            hit.line.chars,
+            hit.position.column_number - 1,
+            key_length,
+            width - _calculate_display_width(tag),
+        )
+        rows.append(tag + text)
+    if number_of_hidden_hits >= 1:
+        rows.append(
+            "{}(+{} more)".format(" " * (label_length + 1), number_of_hidden_hits)
+        )
+    lines: typing.List[Line] = []
+    positions: typing.List[Position] = []
+    offset = 0
+    for i, row in enumerate(rows):
+        char_index = _calculate_char_index(row, width)
+        if _calculate_display_width(row[:char_index]) > width:
+            char_index -= 1
+        chars = row[:char_index]
+        trailing_whitespaces = " " * (width - _calculate_display_width(chars))
+        if i < len(rows) - 1:
+            trailing_whitespaces += "\r\n"
+        lines.append(Line(chars, trailing_whitespaces))
+        if i < len(hits):
+            positions.append(Position(i + 1, 1, offset))
+        offset += len(chars) + len(trailing_whitespaces)
+    return lines, positions
+
+
+def _clip_around(chars: str, x: int, key_length: int, text_width: int) -> str:
+    char_index = _calculate_char_index(chars, x)
+    end_char_index = char_index + key_length
+    start_char_index = min(len(chars) - len(chars.lstrip()), char_index)
+    if _calculate_display_width(chars[start_char_index:end_char_index]) <= text_width:
+        return chars[start_char_index:]
+    # cut the beginning, keep the key in view with some text after it
+    max_display_width = (text_width - 2) * 2 // 3
+    start_char_index = char_index
+    display_width = _calculate_display_width(chars[char_index:end_char_index])
+    while start_char_index >= 1:
+        char_width = _calculate_display_width(chars[start_char_index - 1])
+        if display_width + char_width > max_display_width:
+            break
+        display_width += char_width
+        start_char_index -= 1
+    return ".." + chars[start_char_index:]
+
+
+def jump_to_hit(screen: Screen, hit: _Hit, key: str) -> None:
+    if hit.pane.id == screen.id:
+        screen.jump_to_pos(hit.position.column_number - 1, hit.position.line_number - 1)
+        return
+    _run_tmux_command(
+        "select-window", "-t", hit.pane.id, ";", "select-pane", "-t", hit.pane.id
+    )
+    # the index may be out of date, search again on the current contents
+    target_screen = Screen(hit.pane.id)
+    positions = search_for_key(target_screen.lines, key)
+    if len(positions) == 0:
+        return
+    position = min(
+        positions,
+        key=lambda p: (
+            abs(p.line_number - hit.position.line_number),
+            abs(p.column_number - hit.position.column_number),
+        ),
+    )
+    target_screen.jump_to_pos(position.column_number - 1, position.line_number - 1)
+
+
+def update_index(target: str) -> None:
+    index_dir_name = _get_index_dir_name()
+    if index_dir_name is None:
+        return
+    for pane in _list_panes("-t", target):
+        if target.startswith("%") and pane.id != target:
+            continue
+        _save_pane_index(index_dir_name, pane, _capture_pane(pane.id))
+    _remove_stale_index(index_dir_name)
+
+
+def remove_index(pane_id: str) -> None:
+    index_dir_name = _get_index_dir_name()
+    if index_dir_name is None:
+        return
+    if pane_id != "" and REPLAYER is None:
+        _remove_file(_get_pane_index_file_name(index_dir_name, pane_id))
+    _remove_stale_index(index_dir_name)
+
+
+def _remove_stale_index(index_dir_name: str) -> None:
+    result = _run_tmux_command("list-panes", "-a", "-F", "#{pane_id}")
+    if REPLAYER is not None:
+        return
+    file_names = set(
+        _get_pane_index_file_name(index_dir_name, pane_id)
+        for pane_id in result.split("\n")
+    )
+    for dir_entry in _scan_dir(index_dir_name):
+        if dir_entry.name.endswith(".json") and dir_entry.path not in file_names:
+            _remove_file(dir_entry.path)
+    # the index of a server is left behind once the server exits
+    for dir_entry in _scan_dir(os.path.dirname(index_dir_name)):
+        if not dir_entry.name.startswith("index_") or dir_entry.path == index_dir_name:
+            continue
+        try:
+            os.kill(int(dir_entry.name[len("index_") :]), 0)
+        except ValueError:
+            continue
+        except OSError:
+            shutil.rmtree(dir_entry.path, ignore_errors=True)
+
+
+def _scan_dir(dir_name: str) -> typing.List[os.DirEntry]:
+    try:
+        with os.scandir(dir_name) as dir_entries:
+            return list(dir_entries)
+    except OSError:
+        return []
+
+
+def _list_panes(*args: str) -> typing.List[_Pane]:
+    tmux_var_names = (
+        "pane_id",
+        "window_index",
+        "pane_index",
+        "pane_width",
+        "window_active",
+        "window_activity",
+        "history_size",
+        "cursor_x",
+        "cursor_y",
+    )
+    result = _run_tmux_command(
+        "list-panes",
+        *args,
+        "-F",
+        "\t".join("#{%s}" % s for s in tmux_var_names),
+    )
+    panes: typing.List[_Pane] = []
+    for row in result.split("\n"):
+        tmux_vars = dict(zip(tmux_var_names, row.split("\t")))
+        fingerprint = "{},{},{},{},{}".format(
+            tmux_vars["pane_width"],
+            tmux_vars["window_activity"],
+            tmux_vars["history_size"],
+            tmux_vars["cursor_x"],
+            tmux_vars["cursor_y"],
+        )
+        pane = _Pane(
+            tmux_vars["pane_id"],
+            int(tmux_vars["window_index"]),
+            int(tmux_vars["pane_index"]),
+            int(tmux_vars["pane_width"]),
+            tmux_vars["window_active"] == "1",
+            fingerprint,
+        )
+        panes.append(pane)
+    return panes
+
+
+def _capture_pane(pane_id: str) -> typing.List[str]:
+    chars_list = _run_tmux_command("capture-pane", "-t", pane_id, "-p").split("\n")
+    return chars_list
+
+
+def _get_index_dir_name() -> typing.Optional[str]:
+    server_pid = _run_tmux_command("display-message", "-p", "#{pid}")
+    user_dir_name = os.path.join(
+        tempfile.gettempdir(), "easyjump_{}".format(os.getuid())
+    )
+    index_dir_name = os.path.join(user_dir_name, "index_{}".format(server_pid))
+    if REPLAYER is not None:
+        return index_dir_name
+    if not (_make_private_dir(user_dir_name) and _make_private_dir(index_dir_name)):
+        return None
+    return index_dir_name
+
+
+def _get_pane_index_file_name(index_dir_name: str, pane_id: str) -> str:
+    return os.path.join(index_dir_name, "{}.json".format(pane_id.lstrip("%")))
+
+
+def _load_pane_index(
+    index_dir_name: typing.Optional[str], pane: _Pane
+) -> typing.Optional[typing.List[str]]:
+    if REPLAYER is not None:
+        return REPLAYER.next_event("index", pane_id=pane.id)["chars_list"]
+    entry = None
+    if index_dir_name is not None:
+        file_name = _get_pane_index_file_name(index_dir_name, pane.id)
+        try:
+            with open(file_name, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            pass
+    if entry is None or entry.get("fingerprint") != pane.fingerprint:
+        chars_list = None
+    else:
+        chars_list = entry["chars_list"]
+    if RECORDER is not None:
+        RECORDER.add_event("index", pane_id=pane.id, chars_list=chars_list)
+    return chars_list
+
+
+def _save_pane_index(
+    index_dir_name: typing.Optional[str], pane: _Pane, chars_list: typing.List[str]
+) -> None:
+    if REPLAYER is not None or index_dir_name is None:
+        return
+    file_name = _get_pane_index_file_name(index_dir_name, pane.id)
+    entry = {"fingerprint": pane.fingerprint, "chars_list": chars_list}
+    temp_file_name = None
+    try:
+        fd, temp_file_name = tempfile.mkstemp(dir=index_dir_name)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(temp_file_name, file_name)
+    except OSError:
+        if temp_file_name is not None:
+            _remove_file(temp_file_name)
+
+
 def _run_tmux_command(*args: str) -> str:
-    proc = subprocess.run(("tmux", *args), check=True, capture_output=True)
+    if REPLAYER is not None:
+        event = REPLAYER.next_event("tmux", args=list(args))
+        if "returncode" in event:
+            raise subprocess.CalledProcessError(
+                event["returncode"], ("tmux", *args), stderr=event["stderr"].encode()
+            )
+        return event["result"]
+    proc = subprocess.run(("tmux", *args), capture_output=True)
+    if proc.returncode != 0:
+        if RECORDER is not None:
+            RECORDER.add_event(
+                "tmux",
+                args=list(args),
+                returncode=proc.returncode,
+                stderr=proc.stderr.decode(),
+            )
+        proc.check_returncode()
     result = proc.stdout.decode()[:-1]
+    if RECORDER is not None:
+        RECORDER.add_event("tmux", args=list(args), result=result)
     return result
 
 
-def _get_tmux_vars(*tmux_var_names: str) -> typing.Dict[str, str]:
-    result = _run_tmux_command(
-        "display-message", "-p", "\n".join("#{%s}" % s for s in tmux_var_names)
-    )
+def _write_tty(tty: str, data: str) -> None:
+    if REPLAYER is not None:
+        REPLAYER.next_event("tty", tty=tty, data=data)
+        return
+    with open(tty, "w") as f:
+        f.write(data)
+    if RECORDER is not None:
+        RECORDER.add_event("tty", tty=tty, data=data)
+
+
+def _write_stdout(data: str) -> None:
+    if REPLAYER is not None:
+        REPLAYER.next_event("stdout", data=data)
+        return
+    sys.stdout.write(data)
+    if RECORDER is not None:
+        RECORDER.add_event("stdout", data=data)
+
+
+@contextmanager
+def _stage(stage: str) -> typing.Generator[None, None, None]:
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_time = time.perf_counter() - start_time
+        if RECORDER is not None:
+            RECORDER.add_stage_time(stage, stage_time)
+        if REPLAYER is not None:
+            REPLAYER.add_stage_time(stage, stage_time)
+
+
+def _get_tmux_vars(
+    pane_id: typing.Optional[str], *tmux_var_names: str
+) -> typing.Dict[str, str]:
+    args = ["display-message"]
+    if pane_id is not None:
+        args += ["-t", pane_id]
+    args += ["-p", "\n".join("#{%s}" % s for s in tmux_var_names)]
+    result = _run_tmux_command(*args)
     tmux_var_values = result.split("\n")
     tmux_vars = dict(zip(tmux_var_names, tmux_var_values))
     return tmux_vars
 
 
 def main() -> None:
-    screen = Screen()
-    key = get_key(screen.last_key)
-    positions = search_for_key(screen.lines, key)
+    if UPDATE_INDEX is not None:
+        if UPDATE_INDEX != "":
+            with _stage("update_index"):
+                update_index(UPDATE_INDEX)
+        return
+    if REMOVE_INDEX is not None:
+        with _stage("remove_index"):
+            remove_index(REMOVE_INDEX)
+        return
+    with _stage("screen"):
+        screen = Screen()
+    if ANCHOR is None:
+        with _stage("get_key"):
+            key = get_key(screen.last_key)
+        if SCOPE == Scope.SESSION:
+            session_main(screen, key)
+            return
+        with _stage("search_for_key"):
+            positions = search_for_key(screen.lines, key)
+        label_length = len(key)
+    else:
+        label_length = 2
+        max_number_of_positions = len(_generate_labels(label_length, sys.maxsize))
+        with _stage("find_anchors"):
+            positions = find_anchors(
+                screen.lines,
+                ANCHOR,
+                label_length,
+                max_number_of_positions,
+                screen.cursor_pos,
+            )
     if len(positions) == 0:
         return
     if len(positions) == 1:
         position = positions[0]
-        screen.jump_to_pos(position.column_number - 1, position.line_number - 1)
+        with _stage("jump_to_pos"):
+            screen.jump_to_pos(position.column_number - 1, position.line_number - 1)
         return
-    labels = generate_labels(len(key), len(positions))
-    assigned_labels = assign_labels(labels, positions, screen.cursor_pos)
-    with screen.label_positions(positions, assigned_labels):
-        label_index = select_label(labels)
+    with _stage("assign_labels"):
+        labels = _generate_labels(label_length, len(positions))
+        assigned_labels = assign_labels(labels, positions, screen.cursor_pos)
+    with _stage("select_label"):
+        with screen.label_positions(positions, assigned_labels):
+            label_index = select_label(labels)
     label = labels[label_index]
     position = find_label(label, assigned_labels, positions)
     if position is None:
         return
-    screen.jump_to_pos(position.column_number - 1, position.line_number - 1)
+    with _stage("jump_to_pos"):
+        screen.jump_to_pos(position.column_number - 1, position.line_number - 1)
+
+
+def session_main(screen: Screen, key: str) -> None:
+    with _stage("search_session_for_key"):
+        hits = search_session_for_key(screen, key)
+    if len(hits) == 0:
+        return
+    if len(hits) == 1:
+        with _stage("jump_to_pos"):
+            jump_to_hit(screen, hits[0], key)
+        return
+    with _stage("assign_labels"):
+        number_of_hits = len(hits)
+        if number_of_hits > screen.height:
+            # leave the last row for the number of hidden hits
+            hits = hits[: max(screen.height - 1, 1)]
+        labels = _generate_labels(len(key), len(hits))
+        hits = hits[: len(labels)]
+        lines, positions = list_hits(
+            hits, screen.width, len(labels[-1]), len(key), number_of_hits - len(hits)
+        )
+    with _stage("select_label"):
+        with screen.label_positions(positions, labels, lines):
+            label_index = select_label(labels)
+    with _stage("jump_to_pos"):
+        jump_to_hit(screen, hits[label_index], key)
 
 
 try:
-    main()
+    try:
+        main()
+    except SystemExit:  # cancelled
+        if REPLAYER is None:
+            raise
+    if REPLAYER is not None:
+        REPLAYER.finish()
 except KeyboardInterrupt:
     pass
+finally:
+    if RECORDER is not None:
+        RECORDER.save()
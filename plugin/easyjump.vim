@@ -27,6 +27,7 @@ function! s:do_invoke(mode) abort
     let regions = s:get_regions()
     let smart_case = get(g:, 'easyjump_smart_case', v:true)
     let label_chars = get(g:, 'easyjump_label_chars', '')
+    let label_scheme = get(g:, 'easyjump_label_scheme', '')
     let label_attrs = get(g:, 'easyjump_label_attrs', '')
     let text_attrs = get(g:, 'easyjump_text_attrs', '')
     let command = 'python3'
@@ -36,6 +37,7 @@ function! s:do_invoke(mode) abort
     \    .' --mode=mouse'
     \    .' --smart-case='.(smart_case ? 'on' : 'off')
     \    .' --label-chars='.shellescape(label_chars)
+    \    .' --label-scheme='.shellescape(label_scheme)
     \    .' --label-attrs='.shellescape(label_attrs)
     \    .' --text-attrs='.shellescape(text_attrs)
     \    .' --print-command-only=on'